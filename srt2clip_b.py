@@ -1,115 +1,238 @@
+import codecs
+import mmap
 import os
 import re
+import struct
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-from pydub import AudioSegment
+import av
+import numpy as np
+import soundfile as sf
 
 silence_duration = 500  # 静默时长，单位为毫秒
 
+_IDX_RE = re.compile(rb"^\d+")
+_BLOCK_SEP_RE = re.compile(rb"(?:\r\n|\r(?!\n)|\n){2}")  # 空行；与文本模式一样 \r\n、\r、\n 都算换行
+_AV_EXTENSIONS = {".mp3", ".m4a"}  # 交给 PyAV 解码的格式
+_WAV_HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")  # 16 位 PCM 的 44 字节 WAV 文件头
+
 
 def parse_srt_time(time_str):
     """将 SRT 时间字符串（如 '00:01:23,456'）转换为毫秒"""
-    match = re.match(r"(\d{2}):(\d{2}):(\d{2}),(\d{3})", time_str)
-    if not match:
+    # SRT 时间戳格式固定为 HH:MM:SS,mmm，直接按位置切片（str 和 bytes 均可）
+    colon, comma = (b":", b",") if isinstance(time_str, bytes) else (":", ",")
+    fields = (time_str[0:2], time_str[3:5], time_str[6:8], time_str[9:12])
+    # 逐位校验，int() 本身会接受正负号、空白和下划线
+    if (
+        len(time_str) < 12
+        or time_str[2:3] != colon
+        or time_str[5:6] != colon
+        or time_str[8:9] != comma
+        or not all(field.isascii() and field.isdigit() for field in fields)
+    ):
+        if isinstance(time_str, bytes):
+            time_str = time_str.decode(errors="replace")
         raise ValueError(f"Invalid time format: {time_str}")
 
-    hours, minutes, seconds, milliseconds = map(int, match.groups())
-    return hours * 3600 * 1000 + minutes * 60 * 1000 + seconds * 1000 + milliseconds
+    hours, minutes, seconds, milliseconds = map(int, fields)
+    return ((hours * 60 + minutes) * 60 + seconds) * 1000 + milliseconds
+
+
+def _srt_blocks(mm):
+    """逐个返回 SRT 字幕块的原始字节（已去掉首尾空白）"""
+    # 逐个空行切分，同一文件中混用不同换行符也能正确分块，并跳过 UTF-8 BOM
+    pos = len(codecs.BOM_UTF8) if mm[:3] == codecs.BOM_UTF8 else 0
+
+    for match in _BLOCK_SEP_RE.finditer(mm, pos):
+        block = mm[pos : match.start()].strip()
+        pos = match.end()
+        if block:
+            yield block
+
+    block = mm[pos:].strip()
+    if block:
+        yield block
 
 
 def read_srt_file(file_path):
     """读取 SRT 文件并返回字幕块列表（包含编号、时间戳和文本）"""
-    with open(file_path, "r", encoding="utf-8") as f:
-        content = f.read()
-
-    blocks = [block.strip() for block in content.split("\n\n") if block.strip()]
     subtitles = []
 
-    for block in blocks:
-        lines = block.split("\n")
-        if len(lines) < 3:
-            continue
+    with open(file_path, "rb") as f:
+        # 空文件无法 mmap
+        if os.fstat(f.fileno()).st_size == 0:
+            return subtitles
 
-        idx_line = lines[0]
-        time_line = lines[1]
-        text_line = lines[2]
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            for block in _srt_blocks(mm):
+                lines = block.splitlines()
+                if len(lines) < 3:
+                    continue
 
-        # 提取编号
-        idx_match = re.match(r"^\d+", idx_line)
-        if not idx_match:
-            continue
-        idx = int(idx_match.group())
+                idx_line = lines[0]
+                time_line = lines[1]
+                text_line = lines[2]
 
-        start_time, end_time = time_line.split(" --> ")
-        start = parse_srt_time(start_time)
-        end = parse_srt_time(end_time)
-        text = text_line
+                # 提取编号
+                idx_match = _IDX_RE.match(idx_line)
+                if not idx_match:
+                    continue
+                idx = int(idx_match.group())
 
-        subtitles.append({"idx": idx, "start": start, "end": end, "text": text})
+                # 时间戳直接以字节切片解析，只有保留的文本才解码
+                start_time, end_time = time_line.split(b" --> ")
+                start = parse_srt_time(start_time)
+                end = parse_srt_time(end_time)
+                text = text_line.decode("utf-8")
+
+                subtitles.append({"idx": idx, "start": start, "end": end, "text": text})
 
     return subtitles
 
 
 def format_time(milliseconds):
     """将毫秒转换为 SRT 格式的时间字符串（如 00:01:23,456）"""
-    total_seconds = milliseconds / 1000
-    hours = int(total_seconds // 3600)
-    minutes = int((total_seconds % 3600) // 60)
-    seconds = int(total_seconds % 60)
-    ms = int((total_seconds - int(total_seconds)) * 1000)
+    hours, ms = divmod(int(milliseconds), 3600_000)
+    minutes, ms = divmod(ms, 60_000)
+    seconds, ms = divmod(ms, 1000)
 
     return f"{hours:02d}:{minutes:02d}:{seconds:02d},{ms:03d}"
 
 
-def add_silence(audio, silence_duration):
+def _decode_with_av(audio_file):
+    """用 PyAV 直接调用 libav 解码，并统一转换为交错的 int16 采样"""
+    with av.open(audio_file) as container:
+        stream = container.streams.audio[0]
+        sr = stream.codec_context.sample_rate
+        channels = stream.codec_context.channels
+        # 只转换采样格式（s16 交错），采样率保持原样
+        resampler = av.AudioResampler(format="s16", layout=stream.codec_context.layout, rate=sr)
+
+        chunks = []
+        for frame in container.decode(stream):
+            chunks.extend(f.to_ndarray() for f in resampler.resample(frame))
+        chunks.extend(f.to_ndarray() for f in resampler.resample(None))
+
+    data = np.concatenate(chunks, axis=1) if chunks else np.zeros((1, 0), dtype=np.int16)
+    return data.reshape(-1, channels), sr
+
+
+def load_audio(audio_file):
+    """一次性解码音频文件，返回 (int16 数组[采样数, 声道数], 采样率)"""
+    if Path(audio_file).suffix.lower() in _AV_EXTENSIONS:
+        return _decode_with_av(audio_file)
+
+    return sf.read(audio_file, dtype="int16", always_2d=True)
+
+
+def write_wav(audio_path, clip, sr):
+    """将 16 位 PCM 片段写为 WAV 文件，文件头手工打包，整个文件一次写入"""
+    # 整条流程都保持 int16，不在这里做任何隐式的类型转换
+    if clip.dtype != np.dtype("<i2"):
+        raise ValueError(f"Expected 16-bit PCM samples, got {clip.dtype}")
+
+    data_bytes = clip.tobytes()
+    channels = clip.shape[1]
+    header = _WAV_HEADER.pack(
+        b"RIFF",
+        36 + len(data_bytes),
+        b"WAVE",
+        b"fmt ",
+        16,
+        1,  # PCM
+        channels,
+        sr,
+        sr * channels * 2,
+        channels * 2,
+        16,
+        b"data",
+        len(data_bytes),
+    )
+    Path(audio_path).write_bytes(header + data_bytes)
+
+
+def add_silence(clip, silence):
     """在音频前后添加静默（默认0.5秒）"""
-    silence = AudioSegment.silent(duration=silence_duration)
-    return silence + audio + silence
+    # 一次分配最终长度的缓冲区，首尾拷入预先生成的静默，片段拷贝到中间
+    pad_samples = len(silence)
+    out = np.empty((len(clip) + 2 * pad_samples, clip.shape[1]), dtype=clip.dtype)
+    out[:pad_samples] = silence
+    out[pad_samples : pad_samples + len(clip)] = clip
+    out[pad_samples + len(clip) :] = silence
+    return out
 
 
 def generate_files(srt_file, audio_file, output_dir, silence_duration):
     # 读取 SRT
     subtitles = read_srt_file(srt_file)
 
-    # 读取音频
-    audio = AudioSegment.from_file(audio_file)
+    # 读取音频（只解码一次）
+    data, sr = load_audio(audio_file)
+    silence = np.zeros((silence_duration * sr // 1000, data.shape[1]), dtype=data.dtype)
 
-    # 去掉原文件扩展名，提取主名称
+    # 去掉原文件扩展名，提取主名称，并在导出前一次性生成所有文件名和路径
     base_name = Path(srt_file).stem
-
-    for sub in subtitles:
-        idx = sub["idx"]
+    names = [f"{base_name}_{sub['idx']:03d}" for sub in subtitles]
+    audio_paths = [os.path.join(output_dir, name + ".wav") for name in names]
+    srt_paths = [os.path.join(output_dir, name + ".srt") for name in names]
+
+    # 输出文件比源文件新且大小一致时视为上次已生成，重复运行时直接跳过
+    source_mtime = max(os.path.getmtime(srt_file), os.path.getmtime(audio_file))
+    frame_size = data.shape[1] * 2  # 16 位 PCM，每帧字节数
+
+    def _is_up_to_date(path, expected_size):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return False
+        return stat.st_size == expected_size and stat.st_mtime >= source_mtime
+
+    def _emit_one(sub, audio_path, srt_path):
         text = sub["text"]
         start = sub["start"]
         end = sub["end"]
 
-        # 截取音频片段（按原始时间戳）
-        chunk = audio[start:end]
-
-        # 添加静默
-        chunk_with_silence = add_silence(chunk, silence_duration)
+        # 截取音频片段（按原始时间戳换算为采样点）
+        chunk = data[start * sr // 1000 : end * sr // 1000]
+        frames = len(chunk) + 2 * len(silence)  # 新音频的总帧数（包括静默）
 
-        # 生成音频文件名
-        audio_filename = f"{base_name}_{idx:03d}.wav"
-        audio_path = os.path.join(output_dir, audio_filename)
-        chunk_with_silence.export(audio_path, format="wav")
+        audio_written = not _is_up_to_date(audio_path, _WAV_HEADER.size + frames * frame_size)
+        if audio_written:
+            # 添加静默
+            chunk_with_silence = add_silence(chunk, silence)
+            write_wav(audio_path, chunk_with_silence, sr)
 
         # 新音频的起始时间是 0ms（即从新音频开始）
-        duration = len(chunk_with_silence)  # 新音频的总长度（包括静默）
+        duration = round(frames * 1000 / sr)  # 新音频的总长度（包括静默）
 
         start_time_new = silence_duration
         end_time_new = duration - silence_duration
 
         # 格式化时间戳
         srt_content = f"1\n{format_time(start_time_new)} --> {format_time(end_time_new)}\n{text}\n"
-
-        # 生成字幕文件名
-        srt_filename = f"{base_name}_{idx:03d}.srt"
-        srt_path = os.path.join(output_dir, srt_filename)
-        with open(srt_path, "w", encoding="utf-8") as f:
-            f.write(srt_content)
-
-        print(f"Generated {audio_filename} and {srt_filename}")
+        srt_written = not (
+            os.path.exists(srt_path)
+            and Path(srt_path).read_text(encoding="utf-8") == srt_content
+        )
+        if srt_written:
+            Path(srt_path).write_text(srt_content, encoding="utf-8")
+
+        return audio_written, srt_written
+
+    # 各字幕片段互不依赖，用线程池并行导出；文件写入时会释放 GIL
+    with ThreadPoolExecutor(max_workers=min(8, os.cpu_count() or 1)) as executor:
+        results = executor.map(_emit_one, subtitles, audio_paths, srt_paths)
+        for name, (audio_written, srt_written) in zip(names, results):
+            # WAV 和 SRT 分别判断，日志如实反映哪一个被重新生成
+            if audio_written and srt_written:
+                print(f"Generated {name}.wav and {name}.srt")
+            elif audio_written:
+                print(f"Generated {name}.wav ({name}.srt up to date)")
+            elif srt_written:
+                print(f"Generated {name}.srt ({name}.wav up to date)")
+            else:
+                print(f"Skipped {name}.wav and {name}.srt (up to date)")
 
 
 def srt2clip(srt_file, audio_file, output_dir):
@@ -1,105 +1,159 @@
-import re
+import errno
+import functools
+import os
 import shutil
+import threading
 from pathlib import Path
 
 import gradio as gr
-from pydub import AudioSegment
-from srt2clip_b import srt2clip
+import numpy as np
+from srt2clip_b import (
+    add_silence,
+    format_time,
+    load_audio,
+    parse_srt_time,
+    srt2clip,
+    write_wav,
+)
 
+SAVE_DELAY = 0.5  # 表格停止编辑多少秒后才写回字幕文件
 
-def parse_srt(srt_path):
-    # Read the file content using standard Python file reading
-    with open(srt_path, encoding="utf-8") as f:
-        content = f.read()
-
-    # Split the content into lines
-    lines = content.splitlines()
-    result = []
-    for i in range(0, len(lines), 4):
-        if i + 3 >= len(lines):
-            break
-        idx = lines[i]
-        start_time = lines[i + 1].split(" --> ")[0]
-        end_time = lines[i + 1].split(" --> ")[1]
-        text = lines[i + 2]
-        result.append([idx, start_time, end_time, text])
-
-    # Return the parsed result
-    return result
+_save_lock = threading.Lock()
+_save_timers = {}  # 每个字幕文件尚未触发的延迟写入
 
 
-# When a file is uploaded, parse it and store the original data
-def update_table(file):
-    original_data = parse_srt(file)
-    return original_data
+# 缓存解码后的音频，以路径和修改时间为键，文件变化时自动失效
+@functools.lru_cache(maxsize=4)
+def _load(path, mtime):
+    return load_audio(path)
 
 
-def save_edits(srt_input, data):
-    # 将表格数据转换回 .srt 格式
-    with open(srt_input, "w", encoding="utf-8") as f:
-        for i, row in enumerate(data.values):
-            # 检查 row 是否包含 4 个元素
-            if len(row) == 4:
-                idx, start_time, end_time, text = row
-                f.write(f"{idx}\n")
-                f.write(f"{start_time} --> {end_time}\n")
-                f.write(f"{text}\n\n")
-            else:
-                print(f"Skipping invalid row: {row}")  # 调试信息
+@functools.lru_cache(maxsize=8)
+def _silence(samples, channels):
+    return np.zeros((samples, channels), dtype=np.int16)
 
 
-# 将时间字符串转换为毫秒（用于音频剪辑）
-def parse_srt_time(time_str):
-    match = re.match(r"(\d{2}):(\d{2}):(\d{2}),(\d{3})", time_str)
-    if not match:
-        raise ValueError(f"Invalid time format: {time_str}")
-
-    hours, minutes, seconds, milliseconds = map(int, match.groups())
-    return hours * 3600 * 1000 + minutes * 60 * 1000 + seconds * 1000 + milliseconds
-
+def parse_srt(srt_path):
+    # Split the file into subtitle blocks separated by blank lines
+    blocks = Path(srt_path).read_text(encoding="utf-8").split("\n\n")
+    result = []
+    for block in blocks:
+        lines = block.strip().split("\n")
+        if len(lines) < 3:
+            continue
+        start_time, end_time = lines[1].split(" --> ", 1)
+        # Keep multi-line subtitle text together in one cell
+        result.append([lines[0], start_time, end_time, "\n".join(lines[2:])])
 
-def add_silence(audio, silence_duration):
-    """在音频前后添加静默（默认0.5秒）."""
-    silence = AudioSegment.silent(duration=silence_duration)
-    return silence + audio + silence
+    # Return the parsed result
+    return result
 
 
-def format_time(milliseconds):
-    """将毫秒转换为 SRT 格式的时间字符串（如 00:01:23,456）."""
-    total_seconds = milliseconds / 1000
-    hours = int(total_seconds // 3600)
-    minutes = int((total_seconds % 3600) // 60)
-    seconds = int(total_seconds % 60)
-    ms = int((total_seconds - int(total_seconds)) * 1000)
+def _srt_block(row):
+    # 将表格中的一行转换回 .srt 格式
+    # 检查 row 是否包含 4 个元素
+    if len(row) != 4:
+        print(f"Skipping invalid row: {row}")  # 调试信息
+        return ""
+    idx, start_time, end_time, text = row
+    return f"{idx}\n{start_time} --> {end_time}\n{text}\n\n"
 
-    return f"{hours:02d}:{minutes:02d}:{seconds:02d},{ms:03d}"
 
+def _parse_row_times(start_time, end_time):
+    # 单行时间戳格式错误时返回 None，不影响其他行
+    try:
+        return parse_srt_time(start_time), parse_srt_time(end_time)
+    except ValueError:
+        return None
 
-def extract_audio_clips(audio_input, data, evt: gr.SelectData):
-    # 加载音频文件
-    audio = AudioSegment.from_file(audio_input)
 
-    # 只处理选中的行
+# When a file is uploaded, parse it and store the original data
+def update_table(file):
+    original_data = parse_srt(file)
+    # 记录每行内容及其序列化结果，之后的编辑只需重新生成改动的行
+    saved = {"rows": original_data, "blocks": [_srt_block(row) for row in original_data]}
+    # 加载时换算一次毫秒，以行内的时间字符串为键，增删行后也不会错位
+    times = {}
+    for _, start_time, end_time, _ in original_data:
+        times[(start_time, end_time)] = _parse_row_times(start_time, end_time)
+    return original_data, saved, times
+
+
+def _flush_edits(srt_input, content):
+    with _save_lock:
+        # 计时器在取消前已经开始运行时，只让最新的那个写文件
+        if _save_timers.get(srt_input) is not threading.current_thread():
+            return
+        del _save_timers[srt_input]
+        Path(srt_input).write_text(content, encoding="utf-8")
+
+
+def save_edits(srt_input, data, saved):
+    if not srt_input or not saved:
+        return saved
+
+    # 与上次保存的表格逐行比较，只重新序列化有改动的行
+    rows = [[str(cell) for cell in row] for row in data.values.tolist()]
+    old_rows = saved["rows"]
+    blocks = saved["blocks"][: len(rows)]
+    changed = len(rows) != len(old_rows)
+    for i, row in enumerate(rows):
+        if i < len(old_rows) and row == old_rows[i]:
+            continue
+        block = _srt_block(row)
+        if i < len(blocks):
+            blocks[i] = block
+        else:
+            blocks.append(block)
+        changed = True
+
+    if not changed:
+        return saved
+
+    with _save_lock:
+        # 连续编辑时只保留最后一次，停止编辑 SAVE_DELAY 秒后再写入
+        timer = _save_timers.pop(srt_input, None)
+        if timer is not None:
+            timer.cancel()
+        timer = threading.Timer(SAVE_DELAY, _flush_edits, args=(srt_input, "".join(blocks)))
+        _save_timers[srt_input] = timer
+        timer.start()
+
+    return {"rows": rows, "blocks": blocks}
+
+
+def extract_audio_clips(audio_input, times, evt: gr.SelectData):
+    # 加载音频文件（同一文件只解码一次）
+    audio, sr = _load(audio_input, os.path.getmtime(audio_input))
+
+    # 只处理选中的行，优先使用加载时已换算好的毫秒数
     id_no, start_time, end_time, text = evt.row_value
-
-    start_ms = parse_srt_time(start_time)
-    end_ms = parse_srt_time(end_time)
+    key = (str(start_time), str(end_time))
+    if times and key in times:
+        row_times = times[key]
+    else:
+        # 表格中新插入的行不在缓存里，现场换算
+        row_times = _parse_row_times(*key)
+    if row_times is None:
+        gr.Warning(f"第 {id_no} 条字幕的时间格式无效：{start_time} --> {end_time}")
+        return [None, None]
+    start_ms, end_ms = row_times
 
     # 提取音频片段
-    clip = audio[start_ms:end_ms]
-    clip_with_silence = add_silence(clip, 500)
+    clip = audio[start_ms * sr // 1000 : end_ms * sr // 1000]
+    clip_with_silence = add_silence(clip, _silence(500 * sr // 1000, audio.shape[1]))
 
     # 保存为临时文件
     temp_dir = Path(audio_input).parent
     temp_name = Path(audio_input).stem
     wav_path = temp_dir.joinpath(f"{temp_name}_{id_no}.wav")
-    clip_with_silence.export(str(wav_path), format="wav")
+    write_wav(wav_path, clip_with_silence, sr)
 
     # 生成对应的 SRT 文件
     srt_path = wav_path.with_suffix(".srt")
 
     start_time_new = 500
-    end_time_new = len(clip_with_silence) - 500
+    end_time_new = round(len(clip_with_silence) * 1000 / sr) - 500
     srt_content = (
         f"1\n{format_time(start_time_new)} --> {format_time(end_time_new)}\n{text}\n"
     )
@@ -109,14 +163,25 @@ def extract_audio_clips(audio_input, data, evt: gr.SelectData):
     return result
 
 
+def _move_into(src, dst_dir):
+    # 同一文件系统内直接 rename，跨文件系统时才退回到复制 + 删除
+    dst = os.path.join(dst_dir, os.path.basename(src))
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        shutil.move(src, dst)
+
+
 def save_clip(text_clip, save_path):
     if not Path(save_path).is_dir() or save_path.strip() == "":
         gr.Warning("请输入有效路径！")
     else:
         try:
             audio_clip = text_clip.replace(".srt", ".wav")
-            shutil.move(audio_clip, save_path)
-            shutil.move(text_clip, save_path)
+            _move_into(audio_clip, save_path)
+            _move_into(text_clip, save_path)
             gr.Info(f"文件{Path(text_clip).name}已保存。")
             gr.Info(f"文件{Path(audio_clip).name}已保存。")
         except Exception as e:
@@ -153,19 +218,31 @@ with gr.Blocks(theme=gr.themes.Soft(), title="按字幕切分音频段") as demo
             label="音频片段",
         )
         text_select = gr.File(label="字幕片段", visible=False)
+        # 最近一次保存（或加载）时的表格内容，用于只写回改动的行
+        srt_saved = gr.State()
+        # 各行 (开始, 结束) 时间字符串对应的毫秒数
+        srt_times = gr.State()
         save_path = gr.Textbox(
             label="保存路径",
             placeholder="请输入正确的目标文件夹",
         )
         save_btn = gr.Button("保存选中片段")
         # Update the table when a file is uploaded
-        srt_input.change(fn=update_table, inputs=srt_input, outputs=output_table)
+        srt_input.change(
+            fn=update_table,
+            inputs=srt_input,
+            outputs=[output_table, srt_saved, srt_times],
+        )
         # Save edits back to the .srt file when the table is edited
-        output_table.change(fn=save_edits, inputs=[srt_input, output_table], outputs=[])
+        output_table.change(
+            fn=save_edits,
+            inputs=[srt_input, output_table, srt_saved],
+            outputs=srt_saved,
+        )
 
         output_table.select(
             fn=extract_audio_clips,
-            inputs=[audio_input, output_table],
+            inputs=[audio_input, srt_times],
             outputs=[audio_select, text_select],
         )
 